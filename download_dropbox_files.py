@@ -1,31 +1,307 @@
-import pandas as pd
+import csv
+import json
 import time
 import os
 import re
+import threading
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode, unquote
+import requests
+import websocket
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.chrome.options import Options
-from selenium.common.exceptions import TimeoutException, NoSuchElementException
+from selenium.common.exceptions import (
+    TimeoutException, NoSuchElementException, WebDriverException,
+    ElementClickInterceptedException, ElementNotInteractableException, StaleElementReferenceException
+)
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEventHandler
 import logging
 
+# Characters that are not allowed (or not wanted) in downloaded file names
+SANITIZE_RE = re.compile(r'[<>:"/\\|?*,]')
+
+# Custom renames, keyed by the lower-cased sanitized name
+RENAME_MAP = {
+    'file_ f1-00094_76399_0000000000_ssr.cwa': 'f1-00094_76399_0000000000_ssr.cwa',
+}
+
+class DownloadWatcher(FileSystemEventHandler):
+    """Signal waiters as soon as an expected file appears in the download folder"""
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._pending = {}
+    
+    def register(self, path):
+        """Register an expected file path and return the Event set when it appears"""
+        done = threading.Event()
+        with self._lock:
+            self._pending[os.path.normcase(path)] = done
+        return done
+    
+    def unregister(self, path):
+        with self._lock:
+            self._pending.pop(os.path.normcase(path), None)
+    
+    def _notify(self, path):
+        with self._lock:
+            done = self._pending.get(os.path.normcase(path))
+        if done:
+            done.set()
+    
+    def on_created(self, event):
+        if not event.is_directory:
+            self._notify(event.src_path)
+    
+    def on_moved(self, event):
+        # Chrome finishes a download by renaming <name>.crdownload to <name>
+        if not event.is_directory:
+            self._notify(event.dest_path)
+
+class DownloadEvents:
+    """Follow Chrome's Browser.download* DevTools events and signal when a download completes"""
+    def __init__(self, debugger_address, download_folder, resolve_path, logger):
+        self.resolve_path = resolve_path
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._downloads_done = {}  # guid -> Event set on completion or cancellation
+        self._guid_by_path = {}    # expected path -> guid of its latest download
+        self._waiting = {}         # expected path -> Event registered before the download began
+        
+        version = requests.get(f"http://{debugger_address}/json/version", timeout=5).json()
+        self.ws = websocket.create_connection(version['webSocketDebuggerUrl'], suppress_origin=True)
+        # Chrome only sends the events to the connection that enabled them, so enable them here.
+        # 'allow' keeps the original file names rather than naming files by GUID.
+        self.ws.send(json.dumps({'id': 1, 'method': 'Browser.setDownloadBehavior', 'params': {
+            'behavior': 'allow',
+            'downloadPath': download_folder,
+            'eventsEnabled': True
+        }}))
+        self._reader = threading.Thread(target=self._read_events, daemon=True)
+        self._reader.start()
+    
+    def register(self, path):
+        """Return the Event set when the download saved as path completes"""
+        key = os.path.normcase(path)
+        with self._lock:
+            guid = self._guid_by_path.get(key)
+            if guid:
+                return self._downloads_done[guid]
+            return self._waiting.setdefault(key, threading.Event())
+    
+    def unregister(self, path):
+        key = os.path.normcase(path)
+        with self._lock:
+            self._waiting.pop(key, None)
+            guid = self._guid_by_path.pop(key, None)
+            self._downloads_done.pop(guid, None)
+    
+    def close(self):
+        self.ws.close()
+    
+    def _read_events(self):
+        while True:
+            try:
+                message = json.loads(self.ws.recv())
+            except (websocket.WebSocketException, OSError, ValueError):
+                return  # Connection closed by cleanup or by Chrome exiting
+            
+            if 'error' in message:
+                self.logger.warning(f"DevTools command failed: {message['error']}")
+            method = message.get('method')
+            params = message.get('params', {})
+            if method == 'Browser.downloadWillBegin':
+                key = os.path.normcase(self.resolve_path(params['suggestedFilename']))
+                with self._lock:
+                    self._downloads_done[params['guid']] = self._waiting.pop(key, None) or threading.Event()
+                    self._guid_by_path[key] = params['guid']
+            elif method == 'Browser.downloadProgress' and params.get('state') in ('completed', 'canceled'):
+                with self._lock:
+                    done = self._downloads_done.get(params['guid'])
+                if done:
+                    done.set()
+
+class RateLimiter:
+    """Space out calls made from any thread to at most `rate` per second"""
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+    
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
 class DropboxDownloader:
-    def __init__(self, keyword, download_folder="downloads", delay_between_searches=3):
+    # Selectors are built once here; lookups use the comma-joined unions so a single
+    # find/wait covers every variant of the Dropbox UI
+    SEARCH_CSS = ", ".join([
+        "[data-testid='search-input']",
+        "input[placeholder*='Search']",
+        ".search-input",
+        "input[type='search']",
+        "#search-input"
+    ])
+    
+    CLEAR_CSS = ", ".join([
+        "[data-testid='search-clear-button']",
+        ".search-clear-button",
+        "button[title*='Clear']",
+        "button[aria-label*='Clear']"
+    ])
+    
+    # The context menu's Download entry. The test id is tried first; the looser matches only
+    # count inside an open menu so toolbar buttons or banners elsewhere on the page never win.
+    # CSS can't match on text, so the "Download" label match is a separate XPath.
+    DOWNLOAD_MENU_ITEM_CSS = "[data-testid='download-menu-item']"
+    DOWNLOAD_CSS = ", ".join("[role='menu'] " + s for s in [
+        ".download-option",
+        "*[title*='Download']",
+        "*[aria-label*='Download']",
+        "button[class*='download']",
+        "[role='menuitem'][data-action*='download']"
+    ])
+    DOWNLOAD_XPATH = "//*[@role='menu']//span[contains(text(), 'Download')]"
+    
+    # Runs in the browser: opens the context menu of the row tagged data-dl-id=<id> and clicks
+    # the first Download item that appears, reporting whether it found one before the timeout.
+    # Elements that already matched before the menu was opened are ignored.
+    CONTEXT_DOWNLOAD_SCRIPT = """
+        const [rowId, menuItemCss, downloadCss, downloadXpath, timeoutMs, done] = arguments;
+        const row = document.querySelector('[data-dl-id="' + rowId + '"]');
+        if (!row) { done(false); return; }
+        const matches = () => {
+            const found = [...document.querySelectorAll(menuItemCss), ...document.querySelectorAll(downloadCss)];
+            const xpath = document.evaluate(downloadXpath, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+            for (let i = 0; i < xpath.snapshotLength; i++) found.push(xpath.snapshotItem(i));
+            return found;
+        };
+        const before = new Set(matches());
+        const rect = row.getBoundingClientRect();
+        row.dispatchEvent(new MouseEvent('contextmenu', {
+            bubbles: true, cancelable: true, view: window, button: 2, buttons: 2,
+            clientX: rect.left + rect.width / 2, clientY: rect.top + rect.height / 2
+        }));
+        const deadline = performance.now() + timeoutMs;
+        (function poll() {
+            const item = matches().find(el => !before.has(el));
+            if (item) { item.click(); done(true); }
+            else if (performance.now() < deadline) setTimeout(poll, 20);
+            else done(false);
+        })();
+    """
+    
+    # Selectors for result rows, in order of preference
+    FILE_SELECTORS = [
+        "[data-testid='virtual-list-item']",
+        ".file-row",
+        ".brws-file-name-cell",
+        "[role='row']",
+        ".sl-react-shared-file-row"
+    ]
+    FILE_ROW_CSS = ", ".join(FILE_SELECTORS)
+    
+    # Selectors for the file name inside a result row, in order of preference
+    NAME_SELECTORS = [
+        ".brws-file-name-cell-filename",
+        ".file-name",
+        "span[data-testid='file-name']",
+        "[data-testid='file-name-text']",
+        ".mc-media-cell-text",
+        "span[class*='file-name']",
+        ".brws-file-name",
+        "[class*='filename']",
+        ".mc-media-row-main-content",
+        "[data-testid*='file-row'] span"
+    ]
+    
+    # Row attributes to fall back on when no name element is found
+    NAME_ATTRIBUTES = ["title", "aria-label", "data-filename", "data-testid"]
+    
+    # Runs in the browser: picks the first row selector with matches, resolves each row's
+    # file name and link, and tags the row with data-dl-id so it can be located again later
+    SCRAPE_ROWS_SCRIPT = """
+        const [rowSelectors, nameSelectors, nameAttributes, limit] = arguments;
+        document.querySelectorAll('[data-dl-id]').forEach(el => el.removeAttribute('data-dl-id'));
+        let rows = [];
+        let selector = null;
+        for (const sel of rowSelectors) {
+            rows = Array.from(document.querySelectorAll(sel));
+            if (rows.length) { selector = sel; break; }
+        }
+        // Only trust an anchor whose path ends in the file name; preview and folder links don't
+        const fileLink = (row, name) => {
+            for (const anchor of row.querySelectorAll('a[href]')) {
+                let path;
+                try { path = decodeURIComponent(new URL(anchor.href).pathname).toLowerCase(); } catch (e) { continue; }
+                if (path.endsWith('/' + name.toLowerCase())) return anchor.href;
+            }
+            return null;
+        };
+        const result = rows.slice(0, limit).map((row, id) => {
+            row.setAttribute('data-dl-id', id);
+            const found = (name, source) => ({id: id, element: row, name: name, source: source, link: fileLink(row, name)});
+            for (const sel of nameSelectors) {
+                const el = row.querySelector(sel);
+                const text = el && el.innerText.trim();
+                if (text) return found(text, 'selector: ' + sel);
+            }
+            for (const attr of nameAttributes) {
+                const value = (row.getAttribute(attr) || '').trim();
+                if (value) return found(value, 'attribute: ' + attr);
+            }
+            return {id: id, element: row, name: null, source: null, link: null};
+        });
+        return {selector: selector, total: rows.length, rows: result};
+    """
+    
+    # Runs in the browser: true once any result row mentions the keyword. Rows can be reused
+    # across searches, so this is what tells the new results apart from the previous ones
+    ROW_MATCH_SCRIPT = """
+        const [rowCss, keyword] = arguments;
+        return Array.from(document.querySelectorAll(rowCss))
+            .some(row => row.innerText.toLowerCase().includes(keyword));
+    """
+    
+    def __init__(self, keyword, download_folder="downloads", max_workers=8, requests_per_second=5,
+                 profile_dir="~/.dropbox_downloader_profile"):
         """
         Initialize the Dropbox downloader for a single keyword
         
         Args:
             keyword (str): Single keyword to search for
             download_folder (str): Folder to save downloaded files
-            delay_between_searches (int): Delay in seconds between searches to avoid rate limiting
+            max_workers (int): Number of HTTP downloads to run in parallel
+            requests_per_second (float): Limit on HTTP download requests shared by all workers
+            profile_dir (str): Chrome profile folder kept between runs so the SSO login is remembered
         """
         self.keyword = keyword
         self.download_folder = os.path.abspath(download_folder)
-        self.delay = delay_between_searches
+        self.profile_dir = os.path.expanduser(profile_dir)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.rate_limiter = RateLimiter(requests_per_second)
+        self.pending_downloads = []
+        # Target paths queued or finished over HTTP, so two keywords can't fetch the same file
+        self.claimed_downloads = set()
+        self.claim_lock = threading.Lock()
+        self.use_http = True
         self.driver = None
         self.wait = None
+        self.short_wait = None
+        self.download_watcher = DownloadWatcher()
+        self.download_events = None
+        self.observer = None
+        self.session = None
         
         # Setup logging
         logging.basicConfig(
@@ -52,7 +328,9 @@ class DropboxDownloader:
             "download.default_directory": self.download_folder,
             "download.prompt_for_download": False,
             "download.directory_upgrade": True,
-            "safebrowsing.enabled": True
+            "safebrowsing.enabled": False,
+            # Skip images; stylesheets stay on so menus and rows remain clickable
+            "profile.managed_default_content_settings.images": 2
         }
         chrome_options.add_experimental_option("prefs", prefs)
         
@@ -65,11 +343,36 @@ class DropboxDownloader:
         chrome_options.add_argument("--disable-gpu")
         chrome_options.add_argument("--disable-notifications")  # Disable notifications to avoid DEPRECATED_ENDPOINT error
         
+        # Persistent profile so the Dropbox session cookies survive restarts
+        chrome_options.add_argument(f"--user-data-dir={self.profile_dir}")
+        chrome_options.add_argument("--profile-directory=Default")
+        
+        # Reduce page weight: the downloader only needs the DOM
+        chrome_options.add_argument("--blink-settings=imagesEnabled=false")
+        chrome_options.add_argument("--disable-features=Translate,MediaRouter")
+        chrome_options.add_argument("--safebrowsing-disable-download-protection")
+        
         try:
             self.driver = webdriver.Chrome(options=chrome_options)
             self.driver.maximize_window()
-            self.wait = WebDriverWait(self.driver, 10)
+            # Poll faster than Selenium's 500ms default; the SPA usually settles well within that
+            self.wait = WebDriverWait(self.driver, 10, poll_frequency=0.1)
+            # For local UI such as context menus and the clear button
+            self.short_wait = WebDriverWait(self.driver, 2, poll_frequency=0.05)
             self.logger.info("Chrome driver initialized successfully")
+            
+            # Have verify_download wait on Chrome's own download events, falling back to
+            # watching the download folder if the DevTools connection can't be made
+            try:
+                self.download_events = DownloadEvents(
+                    self.driver.capabilities['goog:chromeOptions']['debuggerAddress'],
+                    self.download_folder, self.expected_download_path, self.logger
+                )
+            except (KeyError, requests.RequestException, websocket.WebSocketException, OSError) as e:
+                self.logger.warning(f"Could not listen for download events via DevTools, watching folder instead: {e}")
+                self.observer = Observer()
+                self.observer.schedule(self.download_watcher, self.download_folder, recursive=False)
+                self.observer.start()
         except Exception as e:
             self.logger.error(f"Error setting up Chrome driver: {e}")
             self.logger.error("Make sure ChromeDriver is installed and in PATH")
@@ -78,6 +381,18 @@ class DropboxDownloader:
     def login_to_dropbox(self):
         """Navigate to Dropbox and wait for user to complete SSO login"""
         try:
+            # A saved profile may still be logged in, in which case no manual step is needed
+            self.driver.get("https://www.dropbox.com/home")
+            try:
+                WebDriverWait(self.driver, 5, poll_frequency=0.1).until(
+                    EC.presence_of_element_located((By.CSS_SELECTOR, self.SEARCH_CSS))
+                )
+                self.logger.info("Already logged in to Dropbox from saved browser profile")
+                self.create_http_session()
+                return True
+            except TimeoutException:
+                pass
+            
             self.driver.get("https://www.dropbox.com/login")
             self.logger.info("Navigated to Dropbox login page")
             
@@ -93,14 +408,9 @@ class DropboxDownloader:
             
             # Wait for main Dropbox interface to load
             try:
-                self.wait.until(
-                    EC.any_of(
-                        EC.presence_of_element_located((By.CSS_SELECTOR, "[data-testid='search-input']")),
-                        EC.presence_of_element_located((By.CSS_SELECTOR, "input[placeholder*='Search']")),
-                        EC.presence_of_element_located((By.CSS_SELECTOR, ".search-input"))
-                    )
-                )
+                self.wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, self.SEARCH_CSS)))
                 self.logger.info("Successfully logged in to Dropbox")
+                self.create_http_session()
                 return True
             except TimeoutException:
                 self.logger.error("Could not find search input. Please make sure you're on the main Dropbox page")
@@ -110,34 +420,45 @@ class DropboxDownloader:
             self.logger.error(f"Error during login process: {e}")
             return False
     
+    def create_http_session(self):
+        """Copy the logged-in browser cookies into a requests session for direct downloads"""
+        self.session = requests.Session()
+        # Keep each cookie's domain and path so they are only sent back to Dropbox
+        for c in self.driver.get_cookies():
+            self.session.cookies.set(c['name'], c['value'], domain=c.get('domain'), path=c.get('path', '/'))
+        self.session.headers.update({'User-Agent': self.driver.execute_script("return navigator.userAgent")})
+        self.logger.info("Created HTTP session from browser cookies")
+    
     def clear_search_context(self):
         """Clear the current search context"""
         try:
             # Try multiple methods to clear search context
-            clear_selectors = [
-                "[data-testid='search-clear-button']",
-                ".search-clear-button",
-                "button[title*='Clear']",
-                "button[aria-label*='Clear']"
-            ]
-            
-            for selector in clear_selectors:
+            try:
+                clear_button = self.driver.find_element(By.CSS_SELECTOR, self.CLEAR_CSS)
+                clear_button.click()
+                # The clear button goes away once the query has been reset
                 try:
-                    clear_button = self.driver.find_element(By.CSS_SELECTOR, selector)
-                    clear_button.click()
-                    self.logger.info("Cleared search context")
-                    time.sleep(1)
-                    return True
-                except:
-                    continue
+                    self.short_wait.until(EC.invisibility_of_element(clear_button))
+                except TimeoutException:
+                    self.logger.warning("Clear button still visible after clearing search")
+                self.logger.info("Cleared search context")
+                return True
+            except NoSuchElementException:
+                pass
             
             # Fallback: try clearing through search input
             search_input = self.get_search_input()
             if search_input:
                 search_input.clear()
                 search_input.send_keys(Keys.ESCAPE)
+                try:
+                    self.wait.until(lambda d: search_input.is_enabled() and search_input.get_attribute("value") == "")
+                except TimeoutException:
+                    self.logger.warning("Search input was not emptied")
+                except StaleElementReferenceException:
+                    # The SPA re-rendered the search box, which only happens once the search is reset
+                    pass
                 self.logger.info("Cleared search context via search input")
-                time.sleep(1)
                 return True
                 
             self.logger.warning("Could not find clear button or search input to clear context")
@@ -149,53 +470,128 @@ class DropboxDownloader:
     
     def get_search_input(self):
         """Helper method to find search input"""
-        search_selectors = [
-            "[data-testid='search-input']",
-            "input[placeholder*='Search']",
-            ".search-input",
-            "input[type='search']",
-            "#search-input"
-        ]
-        
-        for selector in search_selectors:
-            try:
-                search_input = self.wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, selector)))
-                return search_input
-            except:
-                continue
-        return None
+        # One wait on the union so a missing selector doesn't cost a full timeout each
+        try:
+            return self.wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, self.SEARCH_CSS)))
+        except TimeoutException:
+            return None
     
     def sanitize_filename(self, filename):
         """Sanitize filename and apply custom renaming for the target .cwa file"""
         if not filename:
             return None
-        # Custom renaming for the specific file
-        if filename.lower() == 'file, f1-00094_76399_0000000000_ssr.cwa':
-            return 'f1-00094_76399_0000000000_ssr.cwa'
-        # General sanitization for other files
-        return re.sub(r'[<>:"/\\|?*,]', '_', filename).strip()
+        sanitized = SANITIZE_RE.sub('_', filename).strip()
+        return RENAME_MAP.get(sanitized.lower(), sanitized)
+    
+    def expected_download_path(self, filename):
+        """Path a file with this name ends up at in the download folder"""
+        sanitized_filename = self.sanitize_filename(filename)
+        return os.path.join(self.download_folder, sanitized_filename) if sanitized_filename else None
     
     def verify_download(self, filename, timeout=30):
         """Verify if the file was downloaded to the specified folder"""
-        sanitized_filename = self.sanitize_filename(filename)
-        if not sanitized_filename:
+        expected_path = self.expected_download_path(filename)
+        if not expected_path:
             return False
         
-        expected_path = os.path.join(self.download_folder, sanitized_filename)
-        start_time = time.time()
-        
-        while time.time() - start_time < timeout:
+        # Register before checking the disk so a download finishing in between is not missed.
+        # The event also fires for a cancelled download, so the file is checked again after it.
+        waiter = self.download_events or self.download_watcher
+        done = waiter.register(expected_path)
+        try:
+            if not os.path.exists(expected_path):
+                done.wait(timeout)
             if os.path.exists(expected_path):
                 self.logger.info(f"Download verified: {expected_path}")
                 return True
-            # Check for partial downloads (Chrome adds .crdownload extension)
-            if os.path.exists(expected_path + '.crdownload'):
-                self.logger.info(f"Download in progress: {expected_path}.crdownload")
-            time.sleep(1)
+        finally:
+            waiter.unregister(expected_path)
         
         self.logger.warning(f"Download not found: {expected_path}")
         return False
     
+    def direct_download_url(self, file_url):
+        """Turn a Dropbox file link into one that serves the raw file (dl=1)"""
+        parts = urlsplit(file_url)
+        query = dict(parse_qsl(parts.query))
+        query['dl'] = '1'
+        return urlunsplit(parts._replace(query=urlencode(query)))
+    
+    def http_download(self, file_url, filename):
+        """Stream a file straight into the download folder using the browser session cookies"""
+        sanitized_filename = self.sanitize_filename(filename)
+        if not sanitized_filename or not self.session:
+            return False
+        
+        target_path = os.path.join(self.download_folder, sanitized_filename)
+        partial_path = None
+        downloaded = False
+        self.rate_limiter.wait()
+        try:
+            with self.session.get(self.direct_download_url(file_url), stream=True, timeout=60) as response:
+                response.raise_for_status()
+                # An HTML page means a preview or login page, a zip means a folder was served,
+                # and a named attachment must be the file we asked for
+                content_type = response.headers.get('Content-Type', '')
+                disposition = unquote(response.headers.get('Content-Disposition', '')).lower()
+                if (content_type.startswith('text/html') or 'zip' in content_type
+                        or (disposition and filename.lower() not in disposition)):
+                    self.logger.warning(f"Direct download for {sanitized_filename} did not return the file "
+                                        f"(Content-Type: {content_type or 'none'})")
+                    return False
+                # Each worker writes its own partial file
+                with tempfile.NamedTemporaryFile(dir=self.download_folder, prefix=sanitized_filename + '.',
+                                                 suffix='.part', delete=False) as f:
+                    partial_path = f.name
+                    for chunk in response.iter_content(chunk_size=1024 * 1024):
+                        f.write(chunk)
+            os.replace(partial_path, target_path)
+            downloaded = True
+            self.logger.info(f"Downloaded {sanitized_filename} over HTTP: {target_path}")
+            return True
+        except (requests.RequestException, OSError) as e:
+            self.logger.warning(f"Direct download failed for {sanitized_filename}: {e}")
+            if partial_path and os.path.exists(partial_path):
+                os.remove(partial_path)
+            return False
+        finally:
+            if not downloaded:
+                self.release_download(target_path)
+    
+    def claim_download(self, target_path):
+        """Reserve a target path for an HTTP download; False if it is already queued or done"""
+        key = os.path.normcase(target_path)
+        with self.claim_lock:
+            if key in self.claimed_downloads:
+                return False
+            self.claimed_downloads.add(key)
+            return True
+    
+    def release_download(self, target_path):
+        with self.claim_lock:
+            self.claimed_downloads.discard(os.path.normcase(target_path))
+    
+    def context_menu_download(self, file_element):
+        """Right-click the row and click the Download menu item"""
+        webdriver.ActionChains(self.driver).context_click(file_element).perform()
+        
+        # Look for download option in context menu; it is local UI, so a short wait is enough
+        try:
+            download_option = self.short_wait.until(EC.any_of(
+                EC.presence_of_element_located((By.CSS_SELECTOR, self.DOWNLOAD_MENU_ITEM_CSS)),
+                EC.presence_of_element_located((By.CSS_SELECTOR, self.DOWNLOAD_CSS)),
+                EC.presence_of_element_located((By.XPATH, self.DOWNLOAD_XPATH))
+            ))
+        except TimeoutException:
+            return False
+        
+        # Try JavaScript click as fallback
+        try:
+            download_option.click()
+        except (ElementClickInterceptedException, ElementNotInteractableException):
+            self.driver.execute_script("arguments[0].click();", download_option)
+        return True
+    
     def attempt_download(self, file_element, file_name, index):
         """Attempt to download a file with retries"""
         max_attempts = 2
@@ -203,65 +599,51 @@ class DropboxDownloader:
         
         for attempt in range(1, max_attempts + 1):
             try:
-                # Right-click to open context menu
-                webdriver.ActionChains(self.driver).context_click(file_element).perform()
-                time.sleep(1)
-                
-                # Look for download option in context menu
-                download_selectors = [
-                    "[data-testid='download-menu-item']",
-                    "span:contains('Download')",
-                    ".download-option",
-                    "*[title*='Download']",
-                    "*[aria-label*='Download']",
-                    "button[class*='download']",
-                    "[role='menuitem'][data-action*='download']"
-                ]
+                # Open the row's context menu and click Download in a single browser call,
+                # falling back to a real right-click if the dispatched event isn't picked up
+                try:
+                    clicked = self.driver.execute_async_script(
+                        self.CONTEXT_DOWNLOAD_SCRIPT, index, self.DOWNLOAD_MENU_ITEM_CSS,
+                        self.DOWNLOAD_CSS, self.DOWNLOAD_XPATH, 2000
+                    )
+                except WebDriverException as e:
+                    self.logger.debug(f"Scripted context menu failed: {e}")
+                    clicked = False
+                if not clicked:
+                    clicked = self.context_menu_download(file_element)
                 
-                for download_selector in download_selectors:
-                    try:
-                        if "contains" in download_selector:
-                            download_option = self.driver.find_element(By.XPATH, f"//span[contains(text(), 'Download')]")
-                        else:
-                            download_option = self.driver.find_element(By.CSS_SELECTOR, download_selector)
-                        
-                        # Try JavaScript click as fallback
-                        try:
-                            download_option.click()
-                        except:
-                            self.driver.execute_script("arguments[0].click();", download_option)
-                        
-                        self.logger.info(f"Initiated download for .cwa file {index+1} ({sanitized_file_name}) on attempt {attempt}")
-                        # Verify download
-                        if self.verify_download(file_name):
-                            return True
-                        else:
-                            self.logger.warning(f"Download verification failed for {sanitized_file_name} on attempt {attempt}")
-                    except:
-                        continue
+                if clicked:
+                    self.logger.info(f"Initiated download for .cwa file {index+1} ({sanitized_file_name}) on attempt {attempt}")
+                    # Verify download
+                    if self.verify_download(file_name):
+                        return True
+                    else:
+                        self.logger.warning(f"Download verification failed for {sanitized_file_name} on attempt {attempt}")
+                else:
+                    self.logger.warning(f"Download option not found in context menu on attempt {attempt}")
                 
                 # Try alternative: double-click to open file, then look for download button
                 try:
+                    results_url = self.driver.current_url
                     webdriver.ActionChains(self.driver).double_click(file_element).perform()
-                    time.sleep(2)
                     
-                    download_btn = self.driver.find_element(By.XPATH, "//button[contains(text(), 'Download') or @title='Download' or @aria-label='Download']")
+                    download_btn = self.wait.until(EC.presence_of_element_located(
+                        (By.XPATH, "//button[contains(text(), 'Download') or @title='Download' or @aria-label='Download']")
+                    ))
                     try:
                         download_btn.click()
-                    except:
+                    except (ElementClickInterceptedException, ElementNotInteractableException):
                         self.driver.execute_script("arguments[0].click();", download_btn)
                     
                     self.logger.info(f"Downloaded .cwa file {index+1} ({sanitized_file_name}) via file view on attempt {attempt}")
                     if self.verify_download(file_name):
-                        self.driver.back()
-                        time.sleep(2)
+                        self.return_to_results(results_url)
                         return True
                     else:
                         self.logger.warning(f"Download verification failed for {sanitized_file_name} via file view on attempt {attempt}")
                     
-                    self.driver.back()
-                    time.sleep(2)
-                except:
+                    self.return_to_results(results_url)
+                except WebDriverException:
                     self.logger.warning(f"Could not download via file view on attempt {attempt}")
                 
             except Exception as e:
@@ -270,8 +652,8 @@ class DropboxDownloader:
             # Close any context menus
             try:
                 self.driver.find_element(By.TAG_NAME, "body").click()
-                time.sleep(1)
-            except:
+                time.sleep(0.2)  # Let the menu close animation finish
+            except WebDriverException:
                 pass
             
             if attempt < max_attempts:
@@ -281,8 +663,45 @@ class DropboxDownloader:
         self.logger.warning(f"Could not download .cwa file {index+1} ({sanitized_file_name}) after {max_attempts} attempts")
         return False
     
-    def search_and_download(self):
-        """Search for the keyword and download matching .cwa files"""
+    def return_to_results(self, results_url):
+        """Close the file preview, navigating back only if Escape doesn't get us to the results"""
+        webdriver.ActionChains(self.driver).send_keys(Keys.ESCAPE).perform()
+        # The preview is closed once the SPA has put the results URL back
+        try:
+            self.short_wait.until(EC.url_to_be(results_url))
+            return
+        except TimeoutException:
+            pass
+        
+        self.logger.info("Escape did not close the file preview, navigating back")
+        self.driver.back()
+        try:
+            self.wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, self.FILE_ROW_CSS)))
+        except TimeoutException:
+            self.logger.warning("Search results did not reappear after leaving file view")
+    
+    def wait_for_downloads(self):
+        """Block until queued HTTP downloads finish and return {keyword: file names} that need a UI retry"""
+        failed_files = {}
+        for keyword, file_name, future in self.pending_downloads:
+            if not future.result():
+                self.logger.warning(f"HTTP download failed for {file_name} (keyword '{keyword}')")
+                failed_files.setdefault(keyword, set()).add(file_name.lower())
+        self.pending_downloads = []
+        return failed_files
+    
+    def log_element_html(self, element):
+        """Log the start of an element's HTML, fetching it only when DEBUG logging is on"""
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
+        try:
+            element_html = element.get_attribute("outerHTML")[:200]
+            self.logger.debug(f"File element HTML: {element_html}")
+        except (WebDriverException, TypeError):
+            self.logger.debug("Could not retrieve file element HTML")
+    
+    def search_and_download(self, only_files=None):
+        """Search for the keyword and download matching .cwa files (only those in only_files, if given)"""
         try:
             # Clear previous search context
             self.clear_search_context()
@@ -299,99 +718,64 @@ class DropboxDownloader:
             
             self.logger.info(f"Searching for: {self.keyword}")
             
-            # Wait for search results to load
-            time.sleep(5)
-            
-            # Look for file results
-            file_selectors = [
-                "[data-testid='virtual-list-item']",
-                ".file-row",
-                ".brws-file-name-cell",
-                "[role='row']",
-                ".sl-react-shared-file-row"
-            ]
+            # Wait for a result row for this keyword; keywords are file names, so a matching
+            # row must mention it. The previous keyword's rows never satisfy this.
+            try:
+                self.wait.until(lambda d: d.execute_script(self.ROW_MATCH_SCRIPT, self.FILE_ROW_CSS, self.keyword.lower()))
+            except TimeoutException:
+                self.logger.warning(f"No files found for keyword: {self.keyword}")
+                return True
             
-            files_found = []
-            for selector in file_selectors:
-                try:
-                    files_found = self.driver.find_elements(By.CSS_SELECTOR, selector)
-                    if files_found:
-                        self.logger.info(f"Found files using selector: {selector}")
-                        break
-                except:
-                    continue
+            # Collect row elements and their file names in a single browser round-trip
+            scraped = self.driver.execute_script(
+                self.SCRAPE_ROWS_SCRIPT, self.FILE_SELECTORS, self.NAME_SELECTORS, self.NAME_ATTRIBUTES, 5
+            )
             
-            if not files_found:
+            if not scraped["rows"]:
                 self.logger.warning(f"No files found for keyword: {self.keyword}")
                 return True
             
-            self.logger.info(f"Found {len(files_found)} potential results for: {self.keyword}")
+            self.logger.info(f"Found files using selector: {scraped['selector']}")
+            self.logger.info(f"Found {scraped['total']} potential results for: {self.keyword}")
             
             # Process each file
             downloaded_count = 0
-            for i, file_element in enumerate(files_found[:5]):  # Limit to first 5 results
+            for row in scraped["rows"]:  # Limited to first 5 results by the script
+                i = row["id"]
+                file_element = row["element"]
                 try:
-                    # Try multiple selectors to find file name
-                    file_name = None
-                    name_selectors = [
-                        ".brws-file-name-cell-filename",
-                        ".file-name",
-                        "span[data-testid='file-name']",
-                        "[data-testid='file-name-text']",
-                        ".mc-media-cell-text",
-                        "span[class*='file-name']",
-                        ".brws-file-name",
-                        "[class*='filename']",
-                        ".mc-media-row-main-content",
-                        "[data-testid*='file-row'] span"
-                    ]
-                    
-                    for name_selector in name_selectors:
-                        try:
-                            file_name_element = file_element.find_element(By.CSS_SELECTOR, name_selector)
-                            file_name = file_name_element.text.strip().lower()
-                            self.logger.info(f"Found file name '{file_name}' using selector: {name_selector}")
-                            break
-                        except:
-                            continue
-                    
-                    # Fallback: Try getting attributes
-                    if not file_name:
-                        try:
-                            for attr in ["title", "aria-label", "data-filename", "data-testid"]:
-                                file_name = file_element.get_attribute(attr)
-                                if file_name:
-                                    file_name = file_name.strip().lower()
-                                    self.logger.info(f"Found file name '{file_name}' using attribute: {attr}")
-                                    break
-                        except:
-                            pass
-                    
-                    if not file_name:
+                    file_name = row["name"]
+                    if file_name:
+                        self.logger.info(f"Found file name '{file_name}' using {row['source']}")
+                    else:
                         self.logger.warning(f"Could not determine file name for file {i+1}")
-                        try:
-                            element_html = file_element.get_attribute("outerHTML")[:200]
-                            self.logger.debug(f"File element HTML: {element_html}")
-                        except:
-                            self.logger.debug("Could not retrieve file element HTML")
+                        self.log_element_html(file_element)
                         continue
                     
                     # Check if file name ends with .cwa
-                    if not file_name.endswith('.cwa'):
+                    # Names keep Dropbox's casing for saving; compare them lower-cased
+                    if not file_name.lower().endswith('.cwa'):
                         self.logger.info(f"Skipping file {file_name} - does not end with .cwa")
                         continue
+                    
+                    if only_files is not None and file_name.lower() not in only_files:
+                        continue
                         
-                    # Attempt to download the file
-                    if self.attempt_download(file_element, file_name, i):
+                    # Queue an HTTP download when the row links to the file, otherwise drive the UI
+                    if self.use_http and row["link"] and self.session:
+                        target_path = os.path.join(self.download_folder, self.sanitize_filename(file_name))
+                        if not self.claim_download(target_path):
+                            self.logger.info(f"Skipping {file_name} - already queued or downloaded")
+                            continue
+                        future = self.executor.submit(self.http_download, row["link"], file_name)
+                        self.pending_downloads.append((self.keyword, file_name, future))
+                        downloaded_count += 1
+                    elif self.attempt_download(file_element, file_name, i):
                         downloaded_count += 1
                 
                 except Exception as e:
                     self.logger.warning(f"Error processing file {i+1} for keyword '{self.keyword}': {e}")
-                    try:
-                        element_html = file_element.get_attribute("outerHTML")[:200]
-                        self.logger.debug(f"File element HTML: {element_html}")
-                    except:
-                        self.logger.debug("Could not retrieve file element HTML")
+                    self.log_element_html(file_element)
                     continue
             
             self.logger.info(f"Completed search for '{self.keyword}': {downloaded_count} .cwa downloads initiated")
@@ -400,45 +784,56 @@ class DropboxDownloader:
         except Exception as e:
             self.logger.error(f"Error searching for keyword '{self.keyword}': {e}")
             return False
-def cleanup(self):
-    """Cleanup resources"""
-    if self.driver:
-        self.driver.quit()
-        self.logger.info("Browser closed and resources cleaned up")
-
-def run(self):
-    """Main execution method"""
-    try:
-        self.logger.info("Starting search for keyword: {self.keyword}")
+    
+    def cleanup(self):
+        """Cleanup resources"""
+        if self.download_events:
+            self.download_events.close()
+        if self.observer:
+            self.observer.stop()
+            self.observer.join()
+        self.executor.shutdown(cancel_futures=True)
+        if self.session:
+            self.session.close()
+        if self.driver:
+            try:
+                self.driver.quit()
+            finally:
+                # quit() can fail if Chrome already died; make sure chromedriver exits as well
+                self.driver.service.stop()
+            self.logger.info("Browser closed and resources cleaned up")
+    
+    def run(self):
+        """Main execution method"""
+        try:
+            self.logger.info(f"Starting search for keyword: {self.keyword}")
         
-        # Process the keyword
-        if self.search_and_download():
-            self.logger.info("Keyword processed successfully")
-        else:
-            self.logger.error("Keyword processing failed")
+            # Process the keyword
+            if self.search_and_download() and not self.wait_for_downloads():
+                self.logger.info("Keyword processed successfully")
+            else:
+                self.logger.error("Keyword processing failed")
         
-    except KeyboardInterrupt:
-        self.logger.info("Process interrupted by user")
-    except Exception as e:
-        self.logger.error(f"Unexpected error: {e}")
+        except KeyboardInterrupt:
+            self.logger.info("Process interrupted by user")
+        except Exception as e:
+            self.logger.error(f"Unexpected error: {e}")
 
 # Modify the main execution block
 if __name__ == "__main__":
     # Configuration
     DOWNLOAD_FOLDER = r"E:\dropbox"  # Where to save files
-    DELAY_BETWEEN_SEARCHES = 3  # Seconds between searches
     
     try:
         # Read keywords from CSV file
-        dropbox_files = pd.read_csv(r'C:\Users\kaiyijin\NUS Dropbox\Kaiyi Jin\COBRA_Kaiyi\ID_Mapping\dropbox_files.csv') 
-        keywords = dropbox_files['filename'].tolist()
+        with open(r'C:\Users\kaiyijin\NUS Dropbox\Kaiyi Jin\COBRA_Kaiyi\ID_Mapping\dropbox_files.csv', newline='', encoding='utf-8-sig') as f:
+            keywords = [row['filename'] for row in csv.DictReader(f)]
         
         # Initialize downloader with first keyword
         if keywords:
             first_downloader = DropboxDownloader(
                 keyword=keywords[0],
-                download_folder=DOWNLOAD_FOLDER,
-                delay_between_searches=DELAY_BETWEEN_SEARCHES
+                download_folder=DOWNLOAD_FOLDER
             )
             
             try:
@@ -447,24 +842,37 @@ if __name__ == "__main__":
                 if not first_downloader.login_to_dropbox():
                     raise Exception("Failed to login to Dropbox")
                 
+                # Files already on disk (e.g. from an interrupted run), listed once for O(1) lookups
+                existing_files = {name.lower() for name in os.listdir(first_downloader.download_folder)}
+                
                 # Process all keywords using the same browser session
                 for keyword in keywords:
                     try:
+                        expected_file = first_downloader.sanitize_filename(keyword)
+                        if expected_file and expected_file.lower() in existing_files:
+                            first_downloader.logger.info(f"Skipping keyword '{keyword}': {expected_file} already downloaded")
+                            continue
+                        
                         # Update keyword and reuse the driver
                         first_downloader.keyword = keyword
                         
-                        # Process keyword
+                        # Process keyword (the next search waits for the search box to be cleared)
                         if first_downloader.search_and_download():
                             first_downloader.logger.info(f"Successfully processed keyword: {keyword}")
                         else:
                             first_downloader.logger.error(f"Failed to process keyword: {keyword}")
                         
-                        # Wait between searches
-                        time.sleep(DELAY_BETWEEN_SEARCHES)
-                        
                     except Exception as e:
                         first_downloader.logger.error(f"Error processing keyword '{keyword}': {e}")
                         continue
+                
+                # HTTP downloads run in the background; retry any failures through the browser UI
+                retry_files = first_downloader.wait_for_downloads()
+                first_downloader.use_http = False
+                for keyword, file_names in retry_files.items():
+                    first_downloader.keyword = keyword
+                    if not first_downloader.search_and_download(only_files=file_names):
+                        first_downloader.logger.error(f"Failed to process keyword on retry: {keyword}")
                         
             finally:
                 # Cleanup only after all keywords are processed
@@ -473,6 +881,6 @@ if __name__ == "__main__":
     except Exception as e:
         print(f"Error: {e}")
         print("\nMake sure you have:")
-        print("1. Installed the required packages: pip install selenium pandas")
+        print("1. Installed the required packages: pip install selenium watchdog requests websocket-client")
         print("2. ChromeDriver is installed and in your PATH")
         print("3. Provided the correct CSV file path with a 'filename' column")
\ No newline at end of file